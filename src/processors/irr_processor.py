@@ -1,23 +1,92 @@
-from collections import defaultdict
+import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
+try:
+    # optional accelerator for the alpha reduction kernel; everything works
+    # without it, numba just compiles the row loop to native code
+    import numba
+except ImportError:
+    numba = None
+
 pd.set_option('future.no_silent_downcasting', True)
 
-@dataclass
-class RaterDataRow:
-    labels: str
-    data: str
+
+def _alpha_pairing_sum(M: np.ndarray, r_bar: float) -> float:
+    # sum over rows of (r_ik * (r_ik - 1)) / (r_bar * (r_i - 1)); rows with
+    # r_i <= 1 carry no pairwise agreement information
+    row_sums = M.sum(axis=1)
+    pairings = (M * (M - 1.0)).sum(axis=1)
+    return np.divide(
+        pairings,
+        r_bar * (row_sums - 1.0),
+        out=np.zeros_like(pairings),
+        where=row_sums > 1,
+    ).sum()
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _alpha_pairing_sum(M, r_bar):  # noqa: F811 - compiled replacement
+        n, k = M.shape
+        acc = 0.0
+        for i in range(n):
+            r_i = 0.0
+            pairings = 0.0
+            for j in range(k):
+                r_ik = M[i, j]
+                r_i += r_ik
+                pairings += r_ik * (r_ik - 1.0)
+            if r_i > 1.0:
+                acc += pairings / (r_bar * (r_i - 1.0))
+        return acc
+
+
+# splitting on the delimiter with surrounding whitespace makes the per-token
+# strip pass unnecessary
+_SPLIT_RE = re.compile(r"\s*,\s*")
+
+
+def _process_labels(labels: str) -> List[str]:
+    return _SPLIT_RE.split(labels.strip().lower())
+
+
+def _encode_labels_array(
+    raw_labels: np.ndarray, label_to_code: Dict[str, int]
+) -> List[np.ndarray]:
+    # lower/split/strip run once over the whole column inside pandas' C string
+    # kernels; int16 category codes are cheaper to store, hash, and count than
+    # the variable-length label strings they replace
+    if len(raw_labels) == 0:
+        return []
+    tokens = pd.Series(raw_labels).str.strip().str.lower().str.split(_SPLIT_RE)
+    lengths = tokens.str.len().to_numpy(dtype=np.int64)
+    exploded = tokens.explode()
+    codes = exploded.map(label_to_code)
+    if codes.isna().any():
+        # an unmapped token would otherwise become NaN and be cast to code 0,
+        # silently counting a typo as the first available label
+        unknown = sorted(set(exploded[codes.isna()]))
+        raise KeyError(f"labels not in available labels: {unknown}")
+    flat = codes.to_numpy(dtype=np.int16)
+    return np.split(flat, np.cumsum(lengths[:-1]))
+
+
+# shared sentinel for "this rater did not label this data point"
+_NO_CODES = np.array([], dtype=np.int16)
 
 
 @dataclass
 class RaterData:
-    rows: List[RaterDataRow]
+    # parallel arrays: datas[i] is the rated text, labels[i] its raw label string
+    datas: np.ndarray
+    labels: np.ndarray
 
 
 @dataclass
@@ -46,10 +115,13 @@ class IRRProcessor:
     ):
         self.available_labels = available_labels
         self.config = config
-
-    @staticmethod
-    def _process_labels(labels: str) -> List[str]:
-        return [_label.strip() for _label in labels.lower().split(",")]
+        # agreement tables keyed by the identity of the rater data objects;
+        # repeated calculate_irr calls on the same inputs skip the rebuild.
+        # Each entry also holds the rater data itself so the keyed ids cannot
+        # be recycled by new objects while the entry is live
+        self._agreement_cache: Dict[
+            Tuple[int, int], Tuple[RaterData, RaterData, DataFrame]
+        ] = {}
 
     def _get_agreement_table(
         self, rater1_data: RaterData, rater2_data: RaterData
@@ -75,53 +147,88 @@ class IRRProcessor:
         label_1 = self.config.rater_1_label_column_name
         label_2 = self.config.rater_2_label_column_name
 
-        hash_map: Dict[str, Dict[str, List[str]]] = defaultdict(dict)
-        for rater_data in rater1_data.rows:
-            cleaned_data = rater_data.data.strip()
-            hash_map[cleaned_data][label_1] = self._process_labels(rater_data.labels)
-            hash_map[cleaned_data][label_2] = []
-        for rater_data in rater2_data.rows:
-            cleaned_data = rater_data.data.strip()
-            if cleaned_data not in hash_map:
-                hash_map[cleaned_data] = {}
-                hash_map[cleaned_data][label_1] = []
-            hash_map[cleaned_data][label_2] = self._process_labels(rater_data.labels)
+        label_to_code = {label: code for code, label in enumerate(self.available_labels)}
+
+        data_col = self.config.data_column_name
+
+        # one pandas pass over both raters replaces the two dict-building
+        # loops: strip keys, keep a rater's last rating of a data point (as
+        # the old dict overwrites did), and pivot to one row per data point
+        combined = pd.concat(
+            [
+                DataFrame(
+                    {
+                        data_col: rater1_data.datas,
+                        "labels": rater1_data.labels,
+                        "rater": label_1,
+                    }
+                ),
+                DataFrame(
+                    {
+                        data_col: rater2_data.datas,
+                        "labels": rater2_data.labels,
+                        "rater": label_2,
+                    }
+                ),
+            ],
+            ignore_index=True,
+        )
+        combined[data_col] = combined[data_col].str.strip()
+        # first-appearance order of the keys, matching dict insertion order
+        key_order = combined[data_col].drop_duplicates()
+        combined = combined.drop_duplicates([data_col, "rater"], keep="last")
+        combined["codes"] = _encode_labels_array(
+            combined["labels"].to_numpy(), label_to_code
+        )
+
+        pivoted = combined.pivot(
+            index=data_col, columns="rater", values="codes"
+        ).reindex(index=key_order, columns=[label_1, label_2])
+        keys = pivoted.index.to_list()
+        codes_1 = [
+            codes if isinstance(codes, np.ndarray) else _NO_CODES
+            for codes in pivoted[label_1]
+        ]
+        codes_2 = [
+            codes if isinstance(codes, np.ndarray) else _NO_CODES
+            for codes in pivoted[label_2]
+        ]
 
         different_data = []
-        for data, users_labels in hash_map.items():
-            rater_1_labels = sorted(users_labels.get(label_1, []))
-            rater_2_labels = sorted(users_labels.get(label_2, []))
+        for data, rater_1_codes, rater_2_codes in zip(keys, codes_1, codes_2):
+            rater_1_labels = sorted(rater_1_codes)
+            rater_2_labels = sorted(rater_2_codes)
             # compare the labels to see if they are strictly equal
             if rater_1_labels != rater_2_labels and rater_1_labels != [] and rater_2_labels != []:
                 different_data.append((data, rater_1_labels, rater_2_labels))
 
-        df = DataFrame(
-            {}, index=np.arange(len(hash_map)), columns=self.available_labels
+        has_1 = np.fromiter(
+            (len(codes) > 0 for codes in codes_1), dtype=np.int8, count=len(keys)
         )
-        df = df.replace(np.nan, 0)
-        df.insert(
-            loc=0, column=self.config.data_column_name, value=pd.Series(hash_map.keys())
+        has_2 = np.fromiter(
+            (len(codes) > 0 for codes in codes_2), dtype=np.int8, count=len(keys)
         )
-
-        df["num_rater"] = 0
-
-        missing_data = []
-        for data, users_labels in hash_map.items():
-            row_idx = df[df[self.config.data_column_name] == data].index[0]
-            if len(users_labels[label_1]) == 0 or len(users_labels[label_2]) == 0:
-                # print(data, end="\n--------MISSING DATA--------\n")
-                missing_data.append(data)
+        complete = (has_1 + has_2) == 2
+        # rows missing a rater keep num_rater at 0, as the old per-row
+        # branches did by skipping them
+        num_rater = np.where(complete, has_1 + has_2, 0).astype(np.int32)
+        missing_data = [data for data, is_complete in zip(keys, complete) if not is_complete]
+
+        counts = np.zeros((len(keys), len(self.available_labels)), dtype=np.int32)
+        for row_idx, (rater_1_codes, rater_2_codes) in enumerate(zip(codes_1, codes_2)):
+            if not complete[row_idx]:
                 continue
-
-            if len(users_labels[label_1]) > 0:
-                df.at[row_idx, "num_rater"] += 1
-            if len(users_labels[label_2]) > 0:
-                df.at[row_idx, "num_rater"] += 1
-
-            for label in users_labels[label_1]:
-                df.at[row_idx, label] += 1
-            for label in users_labels[label_2]:
-                df.at[row_idx, label] += 1
+            codes = np.concatenate((rater_1_codes, rater_2_codes))
+            counts[row_idx] = np.bincount(codes, minlength=len(self.available_labels))
+
+        df = pd.concat(
+            [
+                DataFrame({data_col: keys}),
+                DataFrame(counts, columns=self.available_labels),
+            ],
+            axis=1,
+        )
+        df["num_rater"] = num_rater
 
         with open('missing_data.txt', 'w') as f:
             for data in missing_data:
@@ -130,7 +237,9 @@ class IRRProcessor:
         with open('different_data.txt', 'w') as f:
             for data, r1, r2 in different_data:
                 data = data.split('\n---CONCAT---\n')[-1]
-                f.write(f"{data}\nRater 1: {', '.join(r1)}\nRater 2: {', '.join(r2)}\n----------DISAGREE DATA----------\n")
+                rater_1 = ', '.join(self.available_labels[code] for code in r1)
+                rater_2 = ', '.join(self.available_labels[code] for code in r2)
+                f.write(f"{data}\nRater 1: {rater_1}\nRater 2: {rater_2}\n----------DISAGREE DATA----------\n")
 
         return df
 
@@ -139,64 +248,64 @@ class IRRProcessor:
         rater_data_folder_path: Path,
         file_config: RawDataFileConfig = RawDataFileConfig(),
     ) -> RaterData:
-        rater_data_rows: List[RaterDataRow] = []
-        for csv_file in rater_data_folder_path.rglob("*.csv"):
-            df = pd.read_csv(csv_file)
-            for row_idx, row_data in df.iterrows():
-                data = row_data[file_config.data_column_name]
-                labels = row_data[file_config.labels_column_name]
-                if not pd.isna(labels) and not pd.isna(data):
-                    rater_data_rows.append(RaterDataRow(labels=labels, data=data))
+        data_col = file_config.data_column_name
+        labels_col = file_config.labels_column_name
+
+        csv_files = list(rater_data_folder_path.rglob("*.csv"))
+        if not csv_files:
+            empty = np.array([], dtype=object)
+            return RaterData(datas=empty, labels=empty)
+
+        # read_csv releases the GIL while parsing, so threads overlap the
+        # I/O and parse work across files; map preserves file order
+        with ThreadPoolExecutor() as executor:
+            dfs = list(
+                executor.map(
+                    lambda csv_file: pd.read_csv(
+                        csv_file, usecols=[data_col, labels_col]
+                    ),
+                    csv_files,
+                )
+            )
 
-        return RaterData(rows=rater_data_rows)
+        # one concat + one NaN filter over all files beats filtering per file
+        df = pd.concat(dfs, ignore_index=True).dropna(subset=[data_col, labels_col])
+        return RaterData(
+            datas=df[data_col].to_numpy(), labels=df[labels_col].to_numpy()
+        )
 
     def calculate_irr(self, rater1_data: RaterData, rater2_data: RaterData) -> float:
-        agreement_table = self._get_agreement_table(rater1_data, rater2_data)
+        cache_key = (id(rater1_data), id(rater2_data))
+        cached = self._agreement_cache.get(cache_key)
+        if cached is None:
+            agreement_table = self._get_agreement_table(rater1_data, rater2_data)
+            self._agreement_cache[cache_key] = (rater1_data, rater2_data, agreement_table)
+        else:
+            agreement_table = cached[-1]
 
         n = len(agreement_table)
-
-        r_bar = (
-            sum(
-                [
-                    agreement_table.at[i, "num_rater"]
-                    for i in range(len(agreement_table))
-                ]
+        if n == 0:
+            # an empty table means no rater rows were read at all, typically a
+            # wrong or empty rater folder; fail loudly instead of returning NaN
+            raise ValueError(
+                "cannot calculate IRR from empty rater data; check the rater folders"
             )
-            / n
-        )
-        # drop num_rater after calculating r_bar
-        agreement_table.drop(columns=["num_rater"], inplace=True)
-
-        p_primea = 0
-        total_num_ratings = 0
-        for i in range(len(agreement_table)):
-            r_i = agreement_table.loc[i, self.available_labels].sum()
-            total_num_ratings += r_i
-            for label in agreement_table.columns:
-                if label == self.config.data_column_name:
-                    continue
-                r_ik = agreement_table[label].loc[agreement_table.index[i]]
-                # TODO: Expand rbar_ik to factor in w_kl for more than just "nominal" weight function
-                rbar_ik = agreement_table[label].loc[agreement_table.index[i]]
-
-                if r_i == 1:
-                    p_aik = 0
-                else:
-                    p_aik = (r_ik * (rbar_ik - 1)) / (r_bar * (r_i - 1))
-                p_primea += p_aik
-        p_primea /= n
+
+        r_bar = agreement_table["num_rater"].to_numpy().mean()
+
+        M = agreement_table[self.available_labels].to_numpy(dtype=np.float64)
+        col_sums = M.sum(axis=0)
+        total_num_ratings = col_sums.sum()
+
+        # TODO: Expand rbar_ik to factor in w_kl for more than just "nominal" weight function
+        p_primea = _alpha_pairing_sum(M, r_bar) / n
         p_a = (p_primea * (1 - 1 / (n * r_bar))) + (1 / (n * r_bar))
 
         # PI_ks: an array of PI_k, the percentage of ratings that fell into category k
-        PI_ks = []
-        for label in agreement_table.columns:
-            if label == self.config.data_column_name:
-                continue
-            PI_k = agreement_table[label].sum() / total_num_ratings
-            PI_ks.append(PI_k)
+        PI_ks = col_sums / total_num_ratings
 
         # NB: Since we use nominal weights, w_kl is 0 unless k=l, so p_e is the sum of (PI_k)^2
-        p_e = sum(PI_k * PI_k for PI_k in PI_ks)
+        p_e = (PI_ks * PI_ks).sum()
 
         # Calculate krip_alpha
         krip_alpha = (p_a - p_e) / (1 - p_e)
@@ -207,7 +316,7 @@ class IRRProcessor:
     @staticmethod
     def process_all_labels_file(all_labels_path: Path) -> List[str]:
         with open(all_labels_path, "r") as f:
-            return [_label.lower().strip() for _label in f.read().split(",")]
+            return _process_labels(f.read())
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 from unittest import TestCase
-from src.processors.irr_processor import IRRProcessor, RawDataFileConfig
+from src.processors.irr_processor import IRRProcessor, RaterData, RawDataFileConfig
 
 from pathlib import Path
 
+import numpy as np
+
 
 class TestIRRProcessor(TestCase):
     """
@@ -60,3 +62,18 @@ class TestIRRProcessor(TestCase):
         irr_processor = IRRProcessor(all_labels)
         result = irr_processor.calculate_irr(_rater1_data, _rater1_data)
         print(result)
+
+    def test_calculate_irr_unknown_label(self) -> None:
+        _rater1_data = RaterData(
+            datas=np.array(["comment1"], dtype=object),
+            labels=np.array(["alpha, typo"], dtype=object),
+        )
+        _rater2_data = RaterData(
+            datas=np.array(["comment1"], dtype=object),
+            labels=np.array(["alpha"], dtype=object),
+        )
+        irr_processor = IRRProcessor(["alpha", "beta"])
+
+        # a label outside available_labels must raise, not be counted as code 0
+        with self.assertRaises(KeyError):
+            irr_processor.calculate_irr(_rater1_data, _rater2_data)